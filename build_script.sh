@@ -16,65 +16,8 @@ fi
 echo "Installing PyInstaller..."
 pip3 install pyinstaller
 
-# Создаем spec файл для PyInstaller
-cat > activity_agent.spec << 'EOF'
-# -*- mode: python ; coding: utf-8 -*-
-
-block_cipher = None
-
-a = Analysis(
-    ['unified_agent.py'],
-    pathex=[],
-    binaries=[],
-    datas=[],
-    hiddenimports=[
-        'subprocess',
-        'logging',
-        'json',
-        'datetime',
-        'random',
-        'time',
-        'os',
-        'sys',
-        'shutil',
-        'urllib.request',
-        'tempfile',
-        'pathlib'
-    ],
-    hookspath=[],
-    hooksconfig={},
-    runtime_hooks=[],
-    excludes=[],
-    win_no_prefer_redirects=False,
-    win_private_assemblies=False,
-    cipher=block_cipher,
-    noarchive=False,
-)
-
-pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
-
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
-    [],
-    name='activity_agent',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=True,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
-EOF
+# Используем spec файл из репозитория (PyInstaller распознает spec по расширению)
+cp pyinstaller_spec.py activity_agent.spec
 
 # Сборка
 echo "Building executable..."
@@ -138,14 +81,16 @@ echo "Installing dependencies and setting up service..."
 echo "Installation completed!"
 echo "Agent installed to: $INSTALL_DIR/activity_agent"
 echo "System binary: /usr/local/bin/activity_agent"
-echo "Service: activity-agent.service"
+echo "Service: activity-agent.service (started at boot, exits after work hours)"
+echo "Timer: activity-agent.timer (starts the service at the beginning of each work day)"
 echo "Working directory: $INSTALL_DIR (as per original agent.service)"
 echo ""
-echo "To start the agent:"
-echo "  sudo systemctl start activity-agent"
+echo "The agent is already running; it starts again automatically each work day."
+echo "After changing start_time in the config, run 'sudo activity_agent --install' again to update the timer."
 echo ""
 echo "To check status:"
 echo "  sudo systemctl status activity-agent"
+echo "  sudo systemctl list-timers activity-agent.timer"
 echo ""
 echo "To view logs:"
 echo "  sudo journalctl -u activity-agent -f"
@@ -44,14 +44,16 @@ echo "Installing dependencies and setting up service..."
 echo "Installation completed!"
 echo "Agent installed to: $INSTALL_DIR/activity_agent"
 echo "System binary: /usr/local/bin/activity_agent"
-echo "Service: activity-agent.service"
+echo "Service: activity-agent.service (started at boot, exits after work hours)"
+echo "Timer: activity-agent.timer (starts the service at the beginning of each work day)"
 echo "Working directory: $INSTALL_DIR (as per original agent.service)"
 echo ""
-echo "To start the agent:"
-echo "  sudo systemctl start activity-agent"
+echo "The agent is already running; it starts again automatically each work day."
+echo "After changing start_time in the config, run 'sudo activity_agent --install' again to update the timer."
 echo ""
 echo "To check status:"
 echo "  sudo systemctl status activity-agent"
+echo "  sudo systemctl list-timers activity-agent.timer"
 echo ""
 echo "To view logs:"
 echo "  sudo journalctl -u activity-agent -f"
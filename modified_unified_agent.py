@@ -11,20 +11,40 @@ import time
 import json
 import subprocess
 import logging
+import logging.handlers
+import queue
+import atexit
 import random
+import signal
+import select
+import threading
+import fcntl
 import shutil
+import types
+import shlex
+import functools
+import concurrent.futures
+import re
 import urllib.request
 import tempfile
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Пути для конфигурационных файлов
 DEFAULT_CONFIG_DIR = "/opt/linux_agent/configs"
 USER_CONFIG_DIR = os.path.expanduser("~/.config/activity_agent")
 SYSTEM_CONFIG_DIR = "/etc/activity_agent"
 
-# Дефолтная конфигурация (как fallback)
-DEFAULT_USER_CONFIG = {
+# Файлы конфигурации больше этого размера не читаются
+MAX_CONFIG_SIZE = 1 << 20
+
+# Дефолтная конфигурация (как fallback), доступна только для чтения
+DEFAULT_USER_CONFIG = types.MappingProxyType({
     "user_id": "USR0012345",
     "username": "john_doe",
     "full_name": "John Doe", 
@@ -49,58 +69,393 @@ DEFAULT_USER_CONFIG = {
     "activity_pattern": "Regular office hours with lunch break",
     "department": "Development",
     "location": "Headquarters"
-}
+})
 
-# Конфигурация для установки приложений
-INSTALLATION_CONFIG = {
+# Конфигурация для установки приложений, доступна только для чтения
+INSTALLATION_CONFIG = types.MappingProxyType({
     "vscode": {
+        "binary": "code",
         "check_command": "code --version",
-        "install_commands": [
+        "repo_setup": [
             "wget -qO- https://packages.microsoft.com/keys/microsoft.asc | gpg --dearmor > packages.microsoft.gpg",
-            "sudo install -o root -g root -m 644 packages.microsoft.gpg /etc/apt/trusted.gpg.d/",
-            "sudo sh -c 'echo \"deb [arch=amd64,arm64,armhf signed-by=/etc/apt/trusted.gpg.d/packages.microsoft.gpg] https://packages.microsoft.com/repos/code stable main\" > /etc/apt/sources.list.d/vscode.list'",
-            "sudo apt update",
-            "sudo apt install -y code"
-        ]
+            "install -o root -g root -m 644 packages.microsoft.gpg /etc/apt/trusted.gpg.d/",
+            "echo \"deb [arch=amd64,arm64,armhf signed-by=/etc/apt/trusted.gpg.d/packages.microsoft.gpg] https://packages.microsoft.com/repos/code stable main\" > /etc/apt/sources.list.d/vscode.list"
+        ],
+        "packages": ["code"]
     },
     "chrome": {
+        "binary": "google-chrome",
         "check_command": "google-chrome --version",
-        "install_commands": [
-            "wget -q -O - https://dl.google.com/linux/linux_signing_key.pub | sudo apt-key add -",
-            "sudo sh -c 'echo \"deb [arch=amd64] http://dl.google.com/linux/chrome/deb/ stable main\" >> /etc/apt/sources.list.d/google-chrome.list'",
-            "sudo apt update",
-            "sudo apt install -y google-chrome-stable"
-        ]
+        "repo_setup": [
+            "wget -q -O - https://dl.google.com/linux/linux_signing_key.pub | apt-key add -",
+            "echo \"deb [arch=amd64] http://dl.google.com/linux/chrome/deb/ stable main\" >> /etc/apt/sources.list.d/google-chrome.list"
+        ],
+        "packages": ["google-chrome-stable"]
     },
     "slack": {
+        "binary": "slack",
         "check_command": "slack --version",
+        # Slack ставится из отдельного .deb, поэтому не входит в общий вызов apt-get
+        "downloads": [
+            "wget https://downloads.slack-edge.com/releases/linux/4.33.90/prod/x64/slack-desktop-4.33.90-amd64.deb"
+        ],
         "install_commands": [
-            "wget https://downloads.slack-edge.com/releases/linux/4.33.90/prod/x64/slack-desktop-4.33.90-amd64.deb",
-            "sudo dpkg -i slack-desktop-4.33.90-amd64.deb",
-            "sudo apt-get install -f -y"
+            "dpkg -i slack-desktop-4.33.90-amd64.deb",
+            "apt-get install -f -y"
         ]
     },
     "docker": {
+        "binary": "docker",
         "check_command": "docker --version",
-        "install_commands": [
-            "sudo apt-get update",
-            "sudo apt-get install -y ca-certificates curl gnupg lsb-release",
-            "sudo mkdir -p /etc/apt/keyrings",
-            "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor -o /etc/apt/keyrings/docker.gpg",
-            "echo \"deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu $(lsb_release -cs) stable\" | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null",
-            "sudo apt-get update",
-            "sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-compose-plugin",
-            "sudo usermod -aG docker $USER"
+        "prerequisites": ["ca-certificates", "curl", "gnupg", "lsb-release"],
+        "repo_setup": [
+            "mkdir -p /etc/apt/keyrings",
+            "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | gpg --dearmor -o /etc/apt/keyrings/docker.gpg",
+            "echo \"deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu $(lsb_release -cs) stable\" | tee /etc/apt/sources.list.d/docker.list > /dev/null"
+        ],
+        "packages": ["docker-ce", "docker-ce-cli", "containerd.io", "docker-compose-plugin"],
+        "post_install": [
+            "usermod -aG docker $USER"
         ]
     },
     "xdotool": {
+        "binary": "xdotool",
         "check_command": "xdotool version",
-        "install_commands": [
-            "sudo apt update",
-            "sudo apt install -y xdotool"
+        "packages": ["xdotool"]
+    }
+})
+
+def freeze_config(value):
+    """Рекурсивно делает конфигурацию неизменяемой: dict -> MappingProxyType, list -> tuple"""
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze_config(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_config(item) for item in value)
+    return value
+
+# Пустой набор команд для неизвестных приложений (общий, без аллокации на каждый вызов)
+EMPTY_APP_CONFIG = types.MappingProxyType({})
+
+# Встроенные команды для работы с приложениями
+BUILTIN_APP_CONFIGS = freeze_config({
+    "Visual Studio Code": {
+        "open": "code",
+        "close": "pkill -x code",
+        "activities": [
+            {
+                "description": "Opening a file",
+                "commands": [
+                    "xdotool key ctrl+o",
+                    "sleep 2",
+                    "xdotool type 'main.py'",
+                    "xdotool key Return"
+                ]
+            },
+            {
+                "description": "Typing code",
+                "commands": [
+                    "xdotool type 'print(\"Hello World\")'",
+                    "xdotool key Return", 
+                    "xdotool key ctrl+s"
+                ]
+            },
+            {
+                "description": "Search in files",
+                "commands": [
+                    "xdotool key ctrl+shift+f",
+                    "sleep 1",
+                    "xdotool type 'function'",
+                    "xdotool key Return"
+                ]
+            }
+        ]
+    },
+    "Slack": {
+        "open": "slack",
+        "close": "pkill -x slack",
+        "activities": [
+            {
+                "description": "Checking messages",
+                "commands": [
+                    "xdotool key ctrl+k",
+                    "sleep 1",
+                    "xdotool type 'general'",
+                    "xdotool key Return"
+                ]
+            },
+            {
+                "description": "Typing message", 
+                "commands": [
+                    "xdotool type 'Good morning team!'",
+                    "xdotool key Return"
+                ]
+            }
+        ]
+    },
+    "Google Chrome": {
+        "open": "google-chrome",
+        "close": "pkill -x chrome",
+        "activities": [
+            {
+                "description": "Browsing documentation",
+                "commands": [
+                    "xdotool key ctrl+l",
+                    "xdotool type 'https://docs.python.org'",
+                    "xdotool key Return",
+                    "sleep 5",
+                    "xdotool key ctrl+f",
+                    "xdotool type 'function'"
+                ]
+            },
+            {
+                "description": "Opening new tab",
+                "commands": [
+                    "xdotool key ctrl+t",
+                    "xdotool type 'https://stackoverflow.com'",
+                    "xdotool key Return"
+                ]
+            },
+            {
+                "description": "Scrolling page",
+                "commands": [
+                    "xdotool key Page_Down",
+                    "sleep 2",
+                    "xdotool key Page_Down", 
+                    "sleep 2",
+                    "xdotool key Page_Up"
+                ]
+            }
+        ]
+    },
+    "Firefox": {
+        "open": "firefox",
+        "close": "pkill -x firefox",
+        "activities": [
+            {
+                "description": "Browsing web",
+                "commands": [
+                    "xdotool key ctrl+l",
+                    "xdotool type 'https://github.com'",
+                    "xdotool key Return"
+                ]
+            }
+        ]
+    },
+    "Docker Desktop": {
+        "open": "docker",
+        "close": "pkill -x docker",
+        "activities": [
+            {
+                "description": "Checking containers",
+                "commands": [
+                    "docker ps",
+                    "sleep 2",
+                    "docker images"
+                ]
+            },
+            {
+                "description": "Building image",
+                "commands": [
+                    "docker build -t test-app .",
+                    "sleep 10"
+                ]
+            }
         ]
     }
-}
+})
+
+def json_loads(data):
+    """Разбирает JSON из байтов, используя orjson при наличии"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj):
+    """Сериализует объект в JSON-строку с отступами, используя orjson при наличии"""
+    # orjson поддерживает только отступ в 2 пробела, поэтому json использует такой же
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+# Символы, при наличии которых команду нужно выполнять через оболочку
+SHELL_METACHARACTERS = frozenset('|&;<>()$`*?[]~#\n')
+
+# Команда-пауза, которую выполняем без запуска /bin/sleep
+SLEEP_COMMAND_RE = re.compile(r'^sleep\s+(\d+(?:\.\d+)?)$')
+
+# Блокировка, которую apt и dpkg держат во время работы, и программы, которые ее берут
+APT_LOCK_FILE = "/var/lib/dpkg/lock-frontend"
+APT_COMMANDS = frozenset({"apt", "apt-get", "dpkg"})
+
+# Кэш результатов shutil.which: имя программы -> полный путь
+_executable_cache = {}
+
+def resolve_executable(name):
+    """Возвращает полный путь к программе, запоминая найденные пути"""
+    path = _executable_cache.get(name)
+    if path is None:
+        # Промахи не кэшируются: программа может появиться после установки
+        path = shutil.which(name)
+        if path is not None:
+            _executable_cache[name] = path
+    return path
+
+@functools.lru_cache(maxsize=None)
+def tokenize_command(command):
+    """Разбивает строку команды на аргументы; набор команд конечен, поэтому результат кэшируется"""
+    return tuple(shlex.split(command))
+
+def split_command(command):
+    """Разбивает простую команду на argv; возвращает None, если нужна оболочка"""
+    if SHELL_METACHARACTERS.intersection(command):
+        return None
+    try:
+        argv = tokenize_command(command)
+    except ValueError:
+        return None
+    if not argv:
+        return None
+    
+    # Неизвестные программы и встроенные команды оставляем оболочке
+    executable = resolve_executable(argv[0])
+    if executable is None:
+        return None
+    return [executable, *argv[1:]]
+
+def execute_command(command, capture_stdout=False, capture_stderr=True):
+    """Выполняет команду (строку или готовый argv), по возможности без /bin/sh"""
+    if isinstance(command, list):
+        argv = [resolve_executable(command[0]) or command[0], *command[1:]]
+    else:
+        argv = split_command(command)
+    # close_fds=False позволяет subprocess запускать команду через posix_spawn (vfork)
+    # вместо fork; собственные дескрипторы агента и так не наследуются (PEP 446)
+    return subprocess.run(
+        argv or command, shell=argv is None,
+        stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+        stderr=subprocess.PIPE if capture_stderr else subprocess.DEVNULL,
+        text=True, close_fds=False
+    )
+
+def wait_for_exit(process, timeout):
+    """Ждет завершения процесса не дольше timeout секунд, возвращает True, если он завершился"""
+    if process.returncode is not None:
+        return True
+    try:
+        # pidfd становится читаемым в момент завершения процесса: ядро будит нас сразу,
+        # без периодических проверок, как в Popen.wait(timeout)
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        try:
+            process.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+    try:
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        exited = bool(poller.poll(timeout * 1000))
+    finally:
+        os.close(pidfd)
+    if exited:
+        process.wait()
+    return exited
+
+def group_member_pids(pgid):
+    """Возвращает pid работающих (не зомби) процессов группы по данным /proc"""
+    pids = []
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat", 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Имя процесса в скобках может содержать пробелы: поля считаются после последней ')'
+        state, _, pgrp = stat.rpartition(b')')[2].split()[:3]
+        if int(pgrp) == pgid and state != b'Z':
+            pids.append(int(entry.name))
+    return pids
+
+def wait_for_pids(pids, timeout):
+    """Ждет завершения процессов по их pidfd не дольше timeout секунд"""
+    deadline = time.monotonic() + timeout
+    poller = select.poll()
+    pidfds = []
+    try:
+        for pid in pids:
+            try:
+                pidfd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                continue
+            except (AttributeError, OSError):
+                # Без pidfd_open остается периодическая проверка
+                time.sleep(min(0.1, timeout))
+                return
+            pidfds.append(pidfd)
+            poller.register(pidfd, select.POLLIN)
+        pending = len(pidfds)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            for pidfd, _ in poller.poll(remaining * 1000):
+                poller.unregister(pidfd)
+                pending -= 1
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+def wait_for_group_exit(process, timeout):
+    """Ждет завершения всей группы процессов, запущенной с start_new_session, не дольше timeout секунд"""
+    deadline = time.monotonic() + timeout
+    if not wait_for_exit(process, timeout):
+        return False
+    # Лаунчеры вроде code завершаются сразу, а само приложение остается в группе:
+    # ждем pidfd всех процессов группы и перечитываем состав, пока он не опустеет
+    while True:
+        pids = group_member_pids(process.pid)
+        if not pids:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        wait_for_pids(pids, remaining)
+
+def format_command(command):
+    """Возвращает команду в виде строки для логов"""
+    return shlex.join(command) if isinstance(command, list) else command
+
+class LoggedCommand:
+    """Аргумент логирования: команда форматируется, только если сообщение действительно пишется"""
+    def __init__(self, command):
+        self.command = command
+    
+    def __str__(self):
+        return format_command(self.command)
+
+# Директории конфигураций, уже проверенные или созданные этим процессом
+_ensured_dirs = set()
+
+# Событие остановки агента (SIGTERM от systemd)
+STOP_EVENT = threading.Event()
+
+def install_stop_handler():
+    """Выставляет STOP_EVENT по SIGTERM через отдельный поток, а не из обработчика сигнала"""
+    # Event.set() берет блокировку, и из обработчика сигнала может зависнуть, если
+    # главный поток прерван, держа ее; поэтому сигнал только пишет свой номер в канал
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(write_fd, False)
+    signal.set_wakeup_fd(write_fd)
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    
+    def watch_signals():
+        while signal.SIGTERM not in os.read(read_fd, 64):
+            pass
+        STOP_EVENT.set()
+    
+    threading.Thread(target=watch_signals, name='stop-signal', daemon=True).start()
 
 # Настройка логирования
 def setup_logging(log_level='INFO'):
@@ -114,14 +469,23 @@ def setup_logging(log_level='INFO'):
     
     log_file = os.path.join(log_dir, "activity_agent.log")
     
-    logging.basicConfig(
-        level=getattr(logging, log_level.upper()),
-        format='%(asctime)s %(levelname)s: %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    handlers = [
+        logging.FileHandler(log_file),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    # Запись на диск идет в фоновом потоке, основной цикл только кладет записи в очередь
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    root_logger = logging.getLogger()
+    root_logger.setLevel(getattr(logging, log_level.upper()))
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
 class ConfigManager:
     """Менеджер конфигураций для работы с внешними файлами"""
@@ -132,18 +496,33 @@ class ConfigManager:
             SYSTEM_CONFIG_DIR,
             USER_CONFIG_DIR
         ]
+        # Кэш разобранных файлов: путь -> ((mtime, размер), конфигурация)
+        self._config_cache = {}
+        # Кэш найденных путей: имя конфигурации -> путь
+        self._path_cache = {}
         self.ensure_config_dirs()
     
     def ensure_config_dirs(self):
         """Создает необходимые директории для конфигураций"""
         for path in self.config_paths:
-            try:
-                os.makedirs(path, exist_ok=True)
-            except PermissionError:
-                logging.warning(f"Cannot create config directory: {path}")
+            if path in _ensured_dirs:
+                continue
+            # Лишний mkdir не нужен, если директория уже есть
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except FileExistsError:
+                    pass
+                except PermissionError:
+                    logging.warning(f"Cannot create config directory: {path}")
+                    continue
+            _ensured_dirs.add(path)
     
     def find_config_file(self, config_name):
         """Ищет файл конфигурации в доступных директориях"""
+        if config_name in self._path_cache:
+            return self._path_cache[config_name]
+        
         possible_names = [
             f"{config_name}.json",
             f"{config_name}_config.json",
@@ -151,22 +530,56 @@ class ConfigManager:
         ]
         
         for config_dir in self.config_paths:
+            # Одно чтение директории вместо stat() на каждое возможное имя
+            try:
+                dir_entries = set(os.listdir(config_dir))
+            except OSError:
+                continue
             for name in possible_names:
-                config_path = os.path.join(config_dir, name)
-                if os.path.exists(config_path):
+                if name in dir_entries:
+                    config_path = os.path.join(config_dir, name)
                     logging.info(f"Found config file: {config_path}")
+                    self._path_cache[config_name] = config_path
                     return config_path
         
         return None
     
+    def read_config_file(self, config_path):
+        """Читает JSON-файл конфигурации, повторно разбирая его только после изменения"""
+        stat = os.stat(config_path)
+        if stat.st_size > MAX_CONFIG_SIZE:
+            raise ValueError(f"Config file is too large: {stat.st_size} bytes")
+        
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._config_cache.get(config_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        
+        with open(config_path, 'rb') as f:
+            config = json_loads(f.read(MAX_CONFIG_SIZE + 1))
+        self._config_cache[config_path] = (signature, config)
+        return config
+    
+    def discover_config_files(self):
+        """Лениво перебирает JSON-файлы директорий конфигураций в порядке имен"""
+        for config_dir in self.config_paths:
+            if not os.path.isdir(config_dir):
+                continue
+            with os.scandir(config_dir) as entries:
+                candidates = sorted(
+                    (entry for entry in entries if entry.name.endswith('.json')),
+                    key=lambda entry: entry.name
+                )
+            for entry in candidates:
+                yield entry.path
+    
     def load_config(self, config_name=None):
         """Загружает конфигурацию из файла или возвращает дефолтную"""
         if config_name:
             config_file = self.find_config_file(config_name)
             if config_file:
                 try:
-                    with open(config_file, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
+                    config = self.read_config_file(config_file)
                     logging.info(f"Loaded config from: {config_file}")
                     return self.validate_config(config)
                 except Exception as e:
@@ -174,19 +587,14 @@ class ConfigManager:
                     return None
         
         # Пытаемся найти любой доступный конфигурационный файл
-        for config_dir in self.config_paths:
-            if os.path.exists(config_dir):
-                for file in os.listdir(config_dir):
-                    if file.endswith('.json'):
-                        config_path = os.path.join(config_dir, file)
-                        try:
-                            with open(config_path, 'r', encoding='utf-8') as f:
-                                config = json.load(f)
-                            logging.info(f"Auto-loaded config from: {config_path}")
-                            return self.validate_config(config)
-                        except Exception as e:
-                            logging.warning(f"Failed to load {config_path}: {e}")
-                            continue
+        for config_path in self.discover_config_files():
+            try:
+                config = self.read_config_file(config_path)
+                logging.info(f"Auto-loaded config from: {config_path}")
+                return self.validate_config(config)
+            except Exception as e:
+                logging.warning(f"Failed to load {config_path}: {e}")
+                continue
         
         # Если ничего не найдено, используем дефолтную конфигурацию
         logging.info("Using default configuration")
@@ -194,8 +602,7 @@ class ConfigManager:
     
     def validate_config(self, config):
         """Валидация конфигурации и добавление недостающих полей"""
-        validated_config = DEFAULT_USER_CONFIG.copy()
-        validated_config.update(config)
+        validated_config = {**DEFAULT_USER_CONFIG, **config}
         
         # Проверяем обязательные поля
         required_fields = ['username', 'work_schedule', 'applications_used']
@@ -262,7 +669,7 @@ class ConfigManager:
                     os.makedirs(config_dir, exist_ok=True)
                     config_path = os.path.join(config_dir, f"{config_name}.json")
                     with open(config_path, 'w', encoding='utf-8') as f:
-                        json.dump(sample_config, f, indent=4, ensure_ascii=False)
+                        f.write(json_dumps(sample_config))
                     logging.info(f"Sample config saved to: {config_path}")
                     return config_path
                 except Exception as e:
@@ -275,16 +682,15 @@ class ConfigManager:
         """Возвращает список доступных конфигураций"""
         configs = []
         for config_dir in self.config_paths:
-            if os.path.exists(config_dir):
-                for file in os.listdir(config_dir):
-                    if file.endswith('.json'):
-                        config_name = file.replace('.json', '')
-                        config_path = os.path.join(config_dir, file)
-                        configs.append({
-                            'name': config_name,
-                            'path': config_path,
-                            'size': os.path.getsize(config_path)
-                        })
+            if os.path.isdir(config_dir):
+                with os.scandir(config_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.json'):
+                            configs.append({
+                                'name': entry.name[:-len('.json')],
+                                'path': entry.path,
+                                'size': entry.stat().st_size
+                            })
         return configs
 
 class ApplicationInstaller:
@@ -292,6 +698,8 @@ class ApplicationInstaller:
     
     def __init__(self):
         self.installed_apps = []
+        # Результаты проверок установки; сбрасываются после шагов установки
+        self.install_status = {}
     
     def check_root_privileges(self):
         """Проверяет наличие root привилегий"""
@@ -299,55 +707,138 @@ class ApplicationInstaller:
     
     def run_command(self, command, check_output=False):
         """Выполняет команду в системе"""
+        if os.path.basename(command.split(maxsplit=1)[0]) in APT_COMMANDS:
+            self.wait_for_apt_lock()
         try:
-            if check_output:
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-                return result.returncode == 0, result.stdout.strip()
-            else:
-                result = subprocess.run(command, shell=True, capture_output=True, text=True)
-                return result.returncode == 0, result.stderr
+            result = execute_command(command, capture_stdout=check_output)
         except Exception as e:
             logging.error(f"Command execution failed: {command} - {e}")
             return False, str(e)
+        if check_output:
+            return result.returncode == 0, result.stdout.strip()
+        return result.returncode == 0, result.stderr
+    
+    def wait_for_apt_lock(self, timeout=300):
+        """Ждет, пока apt и dpkg освободят блокировку, с нарастающим интервалом проверки"""
+        try:
+            fd = os.open(APT_LOCK_FILE, os.O_RDWR)
+        except OSError:
+            return True
+        delay = 0.01
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    # apt использует блокировки fcntl, поэтому проверяем тем же механизмом;
+                    # блокировка снимается сразу, иначе apt-get не сможет ее взять
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+                    return True
+                except OSError:
+                    if time.monotonic() >= deadline:
+                        logging.warning(f"{APT_LOCK_FILE} is still locked after {timeout}s")
+                        return False
+                    time.sleep(delay)
+                    delay = min(delay * 2, 1)
+        finally:
+            os.close(fd)
     
     def is_app_installed(self, app_key):
         """Проверяет, установлено ли приложение"""
         if app_key not in INSTALLATION_CONFIG:
             return True
+        if app_key in self.install_status:
+            return self.install_status[app_key]
         
-        check_cmd = INSTALLATION_CONFIG[app_key]["check_command"]
-        success, _ = self.run_command(check_cmd, check_output=True)
+        # Без исполняемого файла в PATH проверочную команду запускать незачем
+        if shutil.which(INSTALLATION_CONFIG[app_key]["binary"]) is None:
+            success = False
+        else:
+            check_cmd = INSTALLATION_CONFIG[app_key]["check_command"]
+            success, _ = self.run_command(check_cmd, check_output=True)
+        self.install_status[app_key] = success
         return success
     
-    def install_app(self, app_key):
-        """Устанавливает приложение"""
-        if app_key not in INSTALLATION_CONFIG:
-            logging.warning(f"No installation config for {app_key}")
-            return True
-        
-        if self.is_app_installed(app_key):
-            logging.info(f"{app_key} is already installed")
-            return True
-        
-        logging.info(f"Installing {app_key}...")
-        install_commands = INSTALLATION_CONFIG[app_key]["install_commands"]
-        
-        for cmd in install_commands:
+    def run_install_commands(self, commands):
+        """Выполняет команды установки по очереди, останавливаясь на первой ошибке"""
+        for cmd in commands:
             logging.info(f"Executing: {cmd}")
             success, output = self.run_command(cmd)
             if not success:
                 logging.error(f"Failed to execute: {cmd} - {output}")
                 return False
-            time.sleep(2)  # Пауза между командами
-        
-        # Проверяем успешность установки
-        if self.is_app_installed(app_key):
-            logging.info(f"{app_key} installed successfully")
-            self.installed_apps.append(app_key)
+        return True
+    
+    def prepare_app(self, app_key):
+        """Скачивает файлы и подключает репозиторий приложения"""
+        logging.info(f"Installing {app_key}...")
+        app_config = INSTALLATION_CONFIG[app_key]
+        return self.run_install_commands(app_config.get("downloads", []) + app_config.get("repo_setup", []))
+    
+    def install_apps(self, app_keys):
+        """Устанавливает приложения: один apt-get update и один apt-get install на все пакеты"""
+        pending = []
+        for app_key in app_keys:
+            if app_key not in INSTALLATION_CONFIG:
+                logging.warning(f"No installation config for {app_key}")
+            elif self.is_app_installed(app_key):
+                logging.info(f"{app_key} is already installed")
+            else:
+                pending.append(app_key)
+        if not pending:
             return True
-        else:
-            logging.error(f"Failed to install {app_key}")
-            return False
+        
+        # Обновляем индексы и ставим утилиты, нужные для подключения репозиториев
+        logging.info("Updating system packages...")
+        self.run_command("apt-get update")
+        prerequisites = [pkg for app_key in pending for pkg in INSTALLATION_CONFIG[app_key].get("prerequisites", [])]
+        if prerequisites:
+            self.run_install_commands([f"apt-get install -y {' '.join(prerequisites)}"])
+        
+        # Загрузки и подключение репозиториев не зависят друг от друга и упираются в сеть,
+        # поэтому выполняются параллельно; работа с dpkg ниже остается последовательной
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            prepared = list(executor.map(self.prepare_app, pending))
+        ready = []
+        for app_key, success in zip(pending, prepared):
+            if success:
+                ready.append(app_key)
+            else:
+                logging.error(f"Failed to set up repository for {app_key}")
+        
+        # Одно обновление индексов и одна установка всех пакетов из apt
+        apt_apps = [app_key for app_key in ready if INSTALLATION_CONFIG[app_key].get("packages")]
+        if apt_apps:
+            if any(INSTALLATION_CONFIG[app_key].get("repo_setup") for app_key in apt_apps):
+                self.run_command("apt-get update")
+            packages = [pkg for app_key in apt_apps for pkg in INSTALLATION_CONFIG[app_key]["packages"]]
+            if not self.run_install_commands([f"apt-get install -y {' '.join(packages)}"]):
+                # Один недоступный пакет не должен блокировать остальные приложения
+                logging.warning("Combined package install failed, installing applications one by one")
+                for app_key in apt_apps:
+                    self.run_install_commands([f"apt-get install -y {' '.join(INSTALLATION_CONFIG[app_key]['packages'])}"])
+        
+        # Установка из .deb и действия после установки
+        for app_key in ready:
+            app_config = INSTALLATION_CONFIG[app_key]
+            self.run_install_commands(app_config.get("install_commands", []) + app_config.get("post_install", []))
+        
+        # Проверяем успешность установки заново: прежние результаты устарели
+        for app_key in pending:
+            self.install_status.pop(app_key, None)
+        all_installed = True
+        for app_key in pending:
+            if self.is_app_installed(app_key):
+                logging.info(f"{app_key} installed successfully")
+                self.installed_apps.append(app_key)
+            else:
+                logging.error(f"Failed to install {app_key}")
+                all_installed = False
+        return all_installed
+    
+    def install_app(self, app_key):
+        """Устанавливает приложение"""
+        return self.install_apps([app_key])
     
     def install_all_dependencies(self):
         """Устанавливает все необходимые зависимости"""
@@ -355,16 +846,11 @@ class ApplicationInstaller:
             logging.error("Root privileges required for installation")
             return False
         
-        # Обновляем систему
-        logging.info("Updating system packages...")
-        self.run_command("sudo apt update")
-        
         # Устанавливаем основные зависимости
         apps_to_install = ["xdotool", "vscode", "chrome", "slack", "docker"]
         
-        for app in apps_to_install:
-            if not self.install_app(app):
-                logging.warning(f"Failed to install {app}, continuing...")
+        if not self.install_apps(apps_to_install):
+            logging.warning("Some applications failed to install, continuing...")
         
         logging.info(f"Installation complete. Installed apps: {self.installed_apps}")
         return True
@@ -380,299 +866,387 @@ class ActivityUtils:
             return custom_commands[app_name]
         
         # Затем используем встроенные команды
-        app_configs = {
-            "Visual Studio Code": {
-                "open": "code",
-                "close": "pkill -f code",
-                "activities": [
-                    {
-                        "description": "Opening a file",
-                        "commands": [
-                            "xdotool key ctrl+o",
-                            "sleep 2",
-                            "xdotool type 'main.py'",
-                            "xdotool key Return"
-                        ]
-                    },
-                    {
-                        "description": "Typing code",
-                        "commands": [
-                            "xdotool type 'print(\"Hello World\")'",
-                            "xdotool key Return", 
-                            "xdotool key ctrl+s"
-                        ]
-                    },
-                    {
-                        "description": "Search in files",
-                        "commands": [
-                            "xdotool key ctrl+shift+f",
-                            "sleep 1",
-                            "xdotool type 'function'",
-                            "xdotool key Return"
-                        ]
-                    }
-                ]
-            },
-            "Slack": {
-                "open": "slack",
-                "close": "pkill -f slack",
-                "activities": [
-                    {
-                        "description": "Checking messages",
-                        "commands": [
-                            "xdotool key ctrl+k",
-                            "sleep 1",
-                            "xdotool type 'general'",
-                            "xdotool key Return"
-                        ]
-                    },
-                    {
-                        "description": "Typing message", 
-                        "commands": [
-                            "xdotool type 'Good morning team!'",
-                            "xdotool key Return"
-                        ]
-                    }
-                ]
-            },
-            "Google Chrome": {
-                "open": "google-chrome",
-                "close": "pkill -f chrome",
-                "activities": [
-                    {
-                        "description": "Browsing documentation",
-                        "commands": [
-                            "xdotool key ctrl+l",
-                            "xdotool type 'https://docs.python.org'",
-                            "xdotool key Return",
-                            "sleep 5",
-                            "xdotool key ctrl+f",
-                            "xdotool type 'function'"
-                        ]
-                    },
-                    {
-                        "description": "Opening new tab",
-                        "commands": [
-                            "xdotool key ctrl+t",
-                            "xdotool type 'https://stackoverflow.com'",
-                            "xdotool key Return"
-                        ]
-                    },
-                    {
-                        "description": "Scrolling page",
-                        "commands": [
-                            "xdotool key Page_Down",
-                            "sleep 2",
-                            "xdotool key Page_Down", 
-                            "sleep 2",
-                            "xdotool key Page_Up"
-                        ]
-                    }
-                ]
-            },
-            "Firefox": {
-                "open": "firefox",
-                "close": "pkill -f firefox",
-                "activities": [
-                    {
-                        "description": "Browsing web",
-                        "commands": [
-                            "xdotool key ctrl+l",
-                            "xdotool type 'https://github.com'",
-                            "xdotool key Return"
-                        ]
-                    }
-                ]
-            },
-            "Docker Desktop": {
-                "open": "docker",
-                "close": "pkill -f docker",
-                "activities": [
-                    {
-                        "description": "Checking containers",
-                        "commands": [
-                            "docker ps",
-                            "sleep 2",
-                            "docker images"
-                        ]
-                    },
-                    {
-                        "description": "Building image",
-                        "commands": [
-                            "docker build -t test-app .",
-                            "sleep 10"
-                        ]
-                    }
-                ]
-            }
-        }
-        return app_configs.get(app_name, {})
-    
-    @staticmethod
-    def is_work_time(current_time, work_schedule):
-        """Проверяет, находится ли текущее время в рабочих часах"""
-        current_time_only = current_time.time()
-        
-        start_time = datetime.strptime(work_schedule['start_time'], '%H:%M').time()
-        end_time = datetime.strptime(work_schedule['end_time'], '%H:%M').time()
-        
-        return start_time <= current_time_only <= end_time
+        return BUILTIN_APP_CONFIGS.get(app_name, EMPTY_APP_CONFIG)
     
     @staticmethod
-    def is_break_time(current_time, work_schedule):
-        """Проверяет, находится ли текущее время в обеденном перерыве"""
-        current_time_only = current_time.time()
-        
-        breaks = work_schedule.get('breaks', [])
-        for break_info in breaks:
-            break_start = datetime.strptime(break_info['start'], '%H:%M').time()
-            break_duration = break_info['duration_minutes']
-            
-            # Вычисляем время окончания перерыва
-            break_start_dt = datetime.combine(current_time.date(), break_start)
-            break_end_dt = break_start_dt + timedelta(minutes=break_duration)
-            break_end = break_end_dt.time()
-            
-            if break_start <= current_time_only <= break_end:
-                return True
-        
-        return False
+    def time_to_minutes(time_str):
+        """Переводит время в формате 'HH:MM' в минуты от начала суток"""
+        hours, minutes = time_str.split(':')
+        return int(hours) * 60 + int(minutes)
 
 class ActivityAgent:
     """Главный класс агента активности"""
     
-    def __init__(self, config):
+    def __init__(self, config, exit_after_work=False):
         self.config = config
+        self.exit_after_work = exit_after_work
         self.current_app = None
+        self.app_process = None
         self.app_start_time = None
-        self.session_duration = random.randint(300, 900)  # 5-15 минут активности
+        # Собственный генератор агента; при заданном "seed" последовательность действий воспроизводима
+        self.rng = random.Random(config.get('seed'))
+        self.session_duration = self.rng.randint(300, 900)  # 5-15 минут активности
         self.utils = ActivityUtils()
         self.custom_commands = config.get('custom_commands', {})
+        self.apps = tuple(config.get('applications_used', []))
+        # Для каждого приложения заранее готовится набор остальных приложений;
+        # если других нет, выбор идет из полного списка
+        self.other_apps = {
+            app: tuple(other for other in self.apps if other != app) or self.apps
+            for app in self.apps
+        }
+        
+        # Расписание разбирается один раз, в цикле остаются только сравнения целых минут
+        work_schedule = config['work_schedule']
+        self.work_start_minutes = self.utils.time_to_minutes(work_schedule['start_time'])
+        self.work_end_minutes = self.utils.time_to_minutes(work_schedule['end_time'])
+        self.break_periods = []
+        for break_info in work_schedule.get('breaks', []):
+            break_start = self.utils.time_to_minutes(break_info['start'])
+            self.break_periods.append((break_start, break_start + break_info['duration_minutes']))
+        
+        # Команды всех используемых приложений разрешаются один раз при старте
+        self.app_commands = {
+            app: self.utils.get_application_commands(app, self.custom_commands)
+            for app in config.get('applications_used', [])
+        }
+        self.resolve_command_paths()
+    
+    def resolve_command_paths(self):
+        """Заранее находит полные пути программ из команд приложений, чтобы не искать их в PATH в цикле"""
+        resolve_executable('xdotool')
+        for commands in self.app_commands.values():
+            command_lines = [commands.get('open', ''), commands.get('close', '')]
+            for activity in commands.get('activities', []):
+                command_lines.extend(activity['commands'])
+            for command in command_lines:
+                if command:
+                    split_command(command)
     
-    def run_command(self, command):
-        """Выполняет команду и логирует результат"""
-        start_time = time.time()
+    def run_command(self, command, capture_errors=True):
+        """Выполняет команду (строку или готовый argv) и логирует результат"""
+        if not isinstance(command, list):
+            sleep_match = SLEEP_COMMAND_RE.match(command.strip())
+            if sleep_match:
+                self.wait(float(sleep_match.group(1)))
+                return
+        # Время замеряется, только если INFO-сообщения пишутся; команда во всех
+        # сообщениях форматируется лениво через LoggedCommand
+        log_success = logging.getLogger().isEnabledFor(logging.INFO)
+        if log_success:
+            start_time = time.monotonic_ns()
         try:
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
-            duration = time.time() - start_time
-            if result.returncode == 0:
-                logging.info(f"SUCCESS: {command} (duration: {duration:.2f}s)")
-            else:
-                logging.warning(f"COMMAND FAILED: {command} - {result.stderr}")
+            # Вывод GUI-приложений не читаем: без capture_errors лишние каналы не создаются
+            result = execute_command(command, capture_stderr=capture_errors)
         except Exception as e:
-            duration = time.time() - start_time
-            logging.error(f"ERROR: {command} (duration: {duration:.2f}s) - {e}")
+            logging.error("ERROR: %s - %s", LoggedCommand(command), e)
+            return
+        if result.returncode == 0:
+            if log_success:
+                duration = (time.monotonic_ns() - start_time) / 1e9
+                logging.info("SUCCESS: %s (duration: %.2fs)", LoggedCommand(command), duration)
+        elif capture_errors:
+            logging.warning("COMMAND FAILED: %s - %s", LoggedCommand(command), result.stderr)
+        else:
+            logging.warning("COMMAND FAILED: %s - exit code %d", LoggedCommand(command), result.returncode)
     
     def open_application(self, app_name):
         """Открывает приложение"""
-        commands = self.utils.get_application_commands(app_name, self.custom_commands)
+        commands = self.app_commands.get(app_name, EMPTY_APP_CONFIG)
         if commands and 'open' in commands:
-            logging.info(f"Opening application: {app_name}")
-            self.run_command(commands['open'])
+            logging.info("Opening application: %s", app_name)
+            self.app_process = self.launch_application(commands['open'])
             self.current_app = app_name
-            self.app_start_time = time.time()
+            self.app_start_time = time.monotonic()
             return True
         return False
     
+    def launch_application(self, command):
+        """Запускает приложение в отдельной группе процессов, не дожидаясь его завершения"""
+        argv = split_command(command)
+        try:
+            process = subprocess.Popen(
+                argv or command, shell=argv is None, stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                start_new_session=True
+            )
+        except OSError as e:
+            logging.error("ERROR: %s - %s", command, e)
+            return None
+        logging.info("STARTED: %s (pid: %d)", command, process.pid)
+        return process
+    
     def close_application(self, app_name):
         """Закрывает приложение"""
-        commands = self.utils.get_application_commands(app_name, self.custom_commands)
-        if commands and 'close' in commands:
-            logging.info(f"Closing application: {app_name}")
-            self.run_command(commands['close'])
+        commands = self.app_commands.get(app_name, EMPTY_APP_CONFIG)
+        logging.info("Closing application: %s", app_name)
+        if not self.terminate_app_process() and commands and 'close' in commands:
+            # Группы запущенного процесса уже нет (лаунчер передал работу
+            # уже открытому экземпляру или приложение вышло из группы через setsid) -
+            # закрываем настроенной командой. pkill -f сравнивает всю командную строку
+            # и задевает посторонние процессы (pkill -f docker завершает dockerd),
+            # поэтому такие команды не выполняются
+            close_command = commands['close']
+            if close_command.split()[:2] == ['pkill', '-f']:
+                logging.warning("Skipping close command '%s': use 'pkill -x <name>' to match the process name exactly", close_command)
+            else:
+                self.run_command(close_command, capture_errors=False)
         self.current_app = None
+        self.app_process = None
         self.app_start_time = None
     
+    def terminate_app_process(self, timeout=5):
+        """Завершает группу процессов запущенного приложения, возвращает False, если ее уже нет"""
+        process = self.app_process
+        if process is None:
+            return False
+        # Завершившийся лаунчер сначала собирается, иначе зомби держит группу
+        process.poll()
+        try:
+            # start_new_session делает pid лидера идентификатором группы
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return False
+        if not wait_for_group_exit(process, timeout):
+            logging.warning("Process group %d did not exit in %ss, killing", process.pid, timeout)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            wait_for_group_exit(process, timeout)
+        return True
+    
     def simulate_activity(self, app_name):
         """Эмулирует активность в приложении"""
-        commands = self.utils.get_application_commands(app_name, self.custom_commands)
+        commands = self.app_commands.get(app_name, EMPTY_APP_CONFIG)
         if commands and 'activities' in commands:
-            activity = random.choice(commands['activities'])
-            logging.info(f"Simulating activity in {app_name}: {activity['description']}")
+            activity = self.rng.choice(commands['activities'])
+            logging.info("Simulating activity in %s: %s", app_name, activity['description'])
             
-            for cmd in activity['commands']:
+            for cmd in self.group_xdotool_commands(activity['commands']):
                 self.run_command(cmd)
-                time.sleep(random.uniform(1, 3))  # Пауза между командами
+                if self.wait(self.rng.uniform(1, 3)):  # Пауза между командами
+                    return
+    
+    def group_xdotool_commands(self, commands):
+        """Объединяет подряд идущие команды xdotool и паузы между ними в один запуск xdotool"""
+        steps = []
+        batch = None
+        pending_sleep = None
+        for cmd in commands:
+            match = SLEEP_COMMAND_RE.match(cmd)
+            if match:
+                if pending_sleep is not None:
+                    batch = None
+                    steps.append(pending_sleep[0])
+                pending_sleep = (cmd, float(match.group(1)))
+                continue
+            
+            # В цепочку попадают только команды, которые split_command выполнил бы без оболочки;
+            # остальные выполняются отдельно, как и раньше
+            action = None
+            if cmd.startswith('xdotool ') and not SHELL_METACHARACTERS.intersection(cmd):
+                try:
+                    action = tokenize_command(cmd)[1:]
+                except ValueError:
+                    pass
+            if not action:
+                if pending_sleep is not None:
+                    steps.append(pending_sleep[0])
+                    pending_sleep = None
+                batch = None
+                steps.append(cmd)
+                continue
+            
+            # Паузу перед действием выдерживает сам xdotool командой sleep. Темп тот же,
+            # что при отдельных запусках: после каждого шага цикл ждет 1-3 секунды,
+            # так что явная пауза N превращается в N плюс случайные паузы вокруг нее
+            pause = None
+            if batch is None:
+                batch = ['xdotool']
+                steps.append(batch)
+                # Паузу после предыдущего шага уже выдержал simulate_activity
+                if pending_sleep is not None:
+                    pause = pending_sleep[1] + self.rng.uniform(1, 3)
+            else:
+                pause = self.rng.uniform(1, 3)
+                if pending_sleep is not None:
+                    pause += pending_sleep[1] + self.rng.uniform(1, 3)
+            if pause is not None:
+                batch += ['sleep', f"{pause:.2f}"]
+            pending_sleep = None
+            batch += action
+            
+            # type забирает все оставшиеся аргументы, поэтому завершает цепочку
+            if action[:1] == ('type',):
+                batch = None
+        
+        if pending_sleep is not None:
+            steps.append(pending_sleep[0])
+        return steps
+    
+    def wait(self, seconds):
+        """Ждет указанное время, возвращает True, если агент нужно остановить"""
+        return STOP_EVENT.wait(seconds)
+    
+    def is_work_time(self, current_time):
+        """Проверяет, находится ли текущее время в рабочих часах"""
+        minutes = current_time.hour * 60 + current_time.minute
+        return self.work_start_minutes <= minutes < self.work_end_minutes
+    
+    def is_break_time(self, current_time):
+        """Проверяет, находится ли текущее время в перерыве"""
+        minutes = current_time.hour * 60 + current_time.minute
+        for break_start, break_end in self.break_periods:
+            if break_start <= minutes < break_end:
+                return True
+        return False
+    
+    def seconds_until_next_transition(self, current_time):
+        """Возвращает число секунд до ближайшей смены режима (начало/конец работы или перерыва)"""
+        transitions = [self.work_start_minutes, self.work_end_minutes]
+        for break_start, break_end in self.break_periods:
+            transitions += [break_start, break_end]
+        
+        current_seconds = (current_time.hour * 3600 + current_time.minute * 60
+                           + current_time.second + current_time.microsecond / 1e6)
+        upcoming = [m * 60 for m in transitions if m * 60 > current_seconds]
+        # Если сегодня переходов больше нет, ждем начала завтрашнего рабочего дня
+        next_transition = min(upcoming) if upcoming else (24 * 60 + self.work_start_minutes) * 60
+        return next_transition - current_seconds + 1
     
     def should_switch_app(self):
         """Определяет, нужно ли переключиться на другое приложение"""
         if not self.current_app or not self.app_start_time:
             return True
         
-        elapsed = time.time() - self.app_start_time
+        elapsed = time.monotonic() - self.app_start_time
         return elapsed >= self.session_duration
     
-    def get_next_app(self):
-        """Выбирает следующее приложение для работы"""
-        apps = self.config.get('applications_used', [])
-        if not apps:
+    def get_next_app(self, previous_app=None):
+        """Выбирает следующее приложение для работы, отличное от previous_app"""
+        if not self.apps:
             return None
         
-        # Исключаем текущее приложение для разнообразия
-        available_apps = [app for app in apps if app != self.current_app]
-        if not available_apps:
-            available_apps = apps
-        
-        return random.choice(available_apps)
+        # Исключаем предыдущее приложение для разнообразия
+        return self.rng.choice(self.other_apps.get(previous_app, self.apps))
     
     def run(self):
         """Основной цикл работы агента"""
-        logging.info(f"Starting activity agent for user: {self.config.get('username', 'unknown')}")
-        logging.info(f"Role: {self.config.get('role', 'unknown')}")
-        logging.info(f"Work schedule: {self.config.get('work_schedule', {})}")
-        logging.info(f"Applications: {self.config.get('applications_used', [])}")
+        logging.info("Starting activity agent for user: %s", self.config.get('username', 'unknown'))
+        logging.info("Role: %s", self.config.get('role', 'unknown'))
+        logging.info("Work schedule: %s", self.config.get('work_schedule', {}))
+        logging.info("Applications: %s", self.config.get('applications_used', []))
         
-        while True:
+        while not STOP_EVENT.is_set():
             current_time = datetime.now()
             
             # Проверяем, рабочее ли время
-            if not self.utils.is_work_time(current_time, self.config['work_schedule']):
+            if not self.is_work_time(current_time):
                 if self.current_app:
                     logging.info("Work time ended, closing current application")
                     self.close_application(self.current_app)
                 
+                # Следующий запуск выполнит systemd-таймер
+                if self.exit_after_work:
+                    logging.info("Outside work hours, exiting until the next scheduled start")
+                    break
+                
                 # Ждем до начала следующего рабочего дня
-                logging.info("Outside work hours, sleeping...")
-                time.sleep(300)  # Проверяем каждые 5 минут
+                sleep_time = self.seconds_until_next_transition(current_time)
+                logging.info("Outside work hours, sleeping for %.0f seconds...", sleep_time)
+                self.wait(sleep_time)
                 continue
             
             # Проверяем, не время ли перерыва
-            if self.utils.is_break_time(current_time, self.config['work_schedule']):
+            if self.is_break_time(current_time):
                 if self.current_app:
                     logging.info("Break time, closing current application")
                     self.close_application(self.current_app)
                 
-                logging.info("Break time, sleeping...")
-                time.sleep(300)  # Проверяем каждые 5 минут
+                sleep_time = self.seconds_until_next_transition(current_time)
+                logging.info("Break time, sleeping for %.0f seconds...", sleep_time)
+                self.wait(sleep_time)
                 continue
             
             # Определяем, нужно ли переключить приложение
             if self.should_switch_app():
-                # Закрываем текущее приложение
-                if self.current_app:
-                    self.close_application(self.current_app)
+                # Закрываем текущее приложение; close_application сбрасывает current_app,
+                # поэтому его запоминаем для выбора следующего
+                previous_app = self.current_app
+                if previous_app:
+                    self.close_application(previous_app)
                 
                 # Пауза между приложениями
-                pause_time = random.randint(30, 120)  # 30 секунд - 2 минуты
-                logging.info(f"Pausing for {pause_time} seconds between applications")
-                time.sleep(pause_time)
+                pause_time = self.rng.randint(30, 120)  # 30 секунд - 2 минуты
+                logging.info("Pausing for %s seconds between applications", pause_time)
+                if self.wait(pause_time):
+                    break
                 
                 # Открываем новое приложение
-                next_app = self.get_next_app()
+                next_app = self.get_next_app(previous_app)
                 if next_app and self.open_application(next_app):
-                    self.session_duration = random.randint(300, 900)  # Новая длительность сессии
-                    time.sleep(5)  # Даем время приложению запуститься
+                    self.session_duration = self.rng.randint(300, 900)  # Новая длительность сессии
+                    if self.wait(5):  # Даем время приложению запуститься
+                        break
+            
+            # Лаунчеры вроде code завершаются сразу после запуска окна: собираем их,
+            # чтобы не оставлять зомби до закрытия приложения
+            if self.app_process is not None:
+                self.app_process.poll()
             
             # Эмулируем активность в текущем приложении
             if self.current_app:
                 self.simulate_activity(self.current_app)
             
             # Пауза между активностями
-            activity_pause = random.randint(10, 60)  # 10 секунд - 1 минута
-            time.sleep(activity_pause)
+            activity_pause = self.rng.randint(10, 60)  # 10 секунд - 1 минута
+            self.wait(activity_pause)
+        
+        logging.info("Shutting down agent")
+        if self.current_app:
+            self.close_application(self.current_app)
+
+def write_file_if_changed(path, content):
+    """Записывает текст в файл, только если он отличается от текущего; возвращает True при записи"""
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
 
-def create_service_file():
-    """Создает файл сервиса для systemd на основе оригинального agent.service"""
+def copy_file_if_changed(source, targets):
+    """Копирует файл в несколько мест, читая источник один раз; возвращает список обновленных путей"""
+    with open(source, 'rb') as f:
+        data = f.read()
+    changed = []
+    for target in targets:
+        # Сначала сравниваем размер, содержимое читаем только при совпадении
+        if os.path.exists(target) and os.path.getsize(target) == len(data):
+            with open(target, 'rb') as f:
+                if f.read() == data:
+                    continue
+        # Пишем во временный файл рядом и атомарно подменяем цель: запущенный
+        # исполняемый файл не перезаписывается на месте
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            shutil.copystat(source, temp_path)
+            os.chmod(temp_path, 0o755)
+            os.replace(temp_path, target)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        changed.append(target)
+    return changed
+
+def create_service_file(work_schedule):
+    """Создает файлы сервиса и таймера systemd; возвращает True, если они изменились, и None при ошибке"""
     service_content = """[Unit]
 Description=Linux Activity Agent - User Activity Simulator
 After=network.target graphical-session.target
@@ -682,7 +1256,8 @@ Wants=graphical-session.target
 Type=simple
 ExecStart=/usr/local/bin/activity_agent --daemon
 WorkingDirectory=/opt/linux_agent
-Restart=always
+# После окончания рабочего дня агент завершается сам, перезапуск только при сбое
+Restart=on-failure
 RestartSec=10
 User=root
 Group=root
@@ -700,52 +1275,66 @@ SyslogIdentifier=activity-agent
 MemoryMax=512M
 CPUQuota=50%
 
+# Запуск при загрузке: после перезагрузки посреди рабочего дня агент продолжает работу,
+# вне рабочего времени он сразу завершается
 [Install]
 WantedBy=multi-user.target
+"""
+    
+    # Вне рабочего времени процесса нет: сервис запускает таймер в начале рабочего дня.
+    # Время таймера фиксируется при установке: после смены start_time нужен повторный --install
+    timer_content = f"""[Unit]
+Description=Linux Activity Agent - start at the beginning of the work day
+
+[Timer]
+OnCalendar=*-*-* {work_schedule['start_time']}:00
+Persistent=true
+Unit=activity-agent.service
+
+[Install]
+WantedBy=timers.target
 """
     
     try:
-        with open('/etc/systemd/system/activity-agent.service', 'w') as f:
-            f.write(service_content)
-        logging.info("Service file created successfully")
-        return True
+        service_changed = write_file_if_changed('/etc/systemd/system/activity-agent.service', service_content)
+        timer_changed = write_file_if_changed('/etc/systemd/system/activity-agent.timer', timer_content)
     except Exception as e:
         logging.error(f"Failed to create service file: {e}")
-        return False
+        return None
+    if service_changed or timer_changed:
+        logging.info("Service and timer files created successfully")
+        return True
+    logging.info("Service and timer files are up to date")
+    return False
 
-def setup_autostart():
+def setup_autostart(config):
     """Настраивает автозапуск агента используя оригинальную конфигурацию agent.service"""
     try:
-        # Создаем рабочую директорию как указано в оригинальном сервисе
+        # Рабочая директория как указано в оригинальном сервисе; она создается
+        # вместе с директориями конфигураций (DEFAULT_CONFIG_DIR лежит внутри нее)
         work_dir = '/opt/linux_agent'
-        os.makedirs(work_dir, exist_ok=True)
-        
-        # Создаем директории для конфигураций
-        config_dir = os.path.join(work_dir, 'configs')
-        os.makedirs(config_dir, exist_ok=True)
+        ConfigManager().ensure_config_dirs()
         
         # Копируем исполняемый файл в системную директорию
         current_path = os.path.abspath(sys.argv[0])
         target_path = '/usr/local/bin/activity_agent'
-        
-        if current_path != target_path:
-            shutil.copy2(current_path, target_path)
-            os.chmod(target_path, 0o755)
-            logging.info(f"Agent copied to {target_path}")
-        
-        # Также копируем в рабочую директорию для совместимости
         work_agent_path = os.path.join(work_dir, 'activity_agent')
-        if current_path != work_agent_path:
-            shutil.copy2(current_path, work_agent_path)
-            os.chmod(work_agent_path, 0o755)
-            logging.info(f"Agent also copied to {work_agent_path}")
+        
+        # Копируем в системную и рабочую директорию (для совместимости) за одно чтение
+        targets = [path for path in (target_path, work_agent_path) if path != current_path]
+        for path in copy_file_if_changed(current_path, targets):
+            logging.info(f"Agent copied to {path}")
         
         # Создаем файл сервиса на основе оригинального agent.service
-        if create_service_file():
-            # Перезагружаем systemd и включаем сервис
-            subprocess.run(['systemctl', 'daemon-reload'], check=True)
-            subprocess.run(['systemctl', 'enable', 'activity-agent.service'], check=True)
-            logging.info("Service enabled for autostart using original agent.service configuration")
+        units_changed = create_service_file(config['work_schedule'])
+        if units_changed is not None:
+            # Перезагружаем systemd, только если файлы юнитов изменились. Сервис запускается
+            # при загрузке и сразу (вне рабочего времени он завершится сам), таймер - в начале
+            # каждого рабочего дня; уже работающий сервис таймер повторно не запускает
+            if units_changed:
+                subprocess.run(['systemctl', 'daemon-reload'], check=True)
+            subprocess.run(['systemctl', 'enable', '--now', 'activity-agent.service', 'activity-agent.timer'], check=True)
+            logging.info("Service started and timer enabled to start the agent at the beginning of each work day")
             return True
         
     except Exception as e:
@@ -754,8 +1343,12 @@ def setup_autostart():
 
 def main():
     """Главная функция"""
+    setup_logging()
     logging.info("Starting Unified Linux Activity Agent")
     
+    config = ConfigManager().load_config()
+    daemon_mode = False
+    
     # Проверяем аргументы командной строки
     if len(sys.argv) > 1:
         if sys.argv[1] == '--install':
@@ -770,17 +1363,22 @@ def main():
             # Устанавливаем зависимости
             installer.install_all_dependencies()
             
-            # Настраиваем автозапуск
-            setup_autostart()
+            # Настраиваем автозапуск; агент запускает systemd, второй экземпляр
+            # в этом процессе управлял бы тем же дисплеем параллельно с ним
+            if setup_autostart(config):
+                logging.info("Installation completed. Agent is running as activity-agent.service")
+                return
             
-            logging.info("Installation completed. Starting agent...")
+            logging.info("Installation completed without autostart. Starting agent...")
             
         elif sys.argv[1] == '--daemon':
             # Режим демона (запуск через systemd)
             logging.info("Daemon mode activated")
+            daemon_mode = True
     
-    # Создаем и запускаем агента
-    agent = ActivityAgent(USER_CONFIG)
+    # Создаем и запускаем агента; под systemd он завершается после рабочего дня
+    agent = ActivityAgent(config, exit_after_work=daemon_mode)
+    install_stop_handler()
     
     try:
         agent.run()
@@ -792,6 +1390,8 @@ def main():
         logging.error(f"Agent crashed: {e}")
         if agent.current_app:
             agent.close_application(agent.current_app)
+        # Ненулевой код нужен, чтобы systemd перезапустил агента (Restart=on-failure)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
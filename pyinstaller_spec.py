@@ -4,7 +4,7 @@
 block_cipher = None
 
 a = Analysis(
-    ['unified_agent.py'],
+    ['modified_unified_agent.py'],
     pathex=[],
     binaries=[
         # Добавляем системные утилиты если нужно
@@ -13,27 +13,8 @@ a = Analysis(
     datas=[
         # Добавляем дополнительные файлы если нужно
     ],
-    hiddenimports=[
-        'subprocess',
-        'logging',
-        'json',
-        'datetime',
-        'random',
-        'time',
-        'os',
-        'sys',
-        'shutil',
-        'urllib.request',
-        'tempfile',
-        'pathlib',
-        'collections',
-        'threading',
-        'signal',
-        'functools',
-        'itertools',
-        'socket',
-        'platform'
-    ],
+    # Все модули агента находятся статическим анализом
+    hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -53,12 +34,32 @@ a = Analysis(
     noarchive=False,
 )
 
-# Исключаем ненужные модули для уменьшения размера
-a.binaries = [x for x in a.binaries if not x[0].startswith('lib')]
+# Исключаем ненужные модули для уменьшения размера; libpython, libz, libssl и
+# остальные зависимости интерпретатора нужны для запуска на чистой системе
+a.binaries = [x for x in a.binaries if not x[0].startswith(('libtcl', 'libtk'))]
+# Данные Tcl/Tk не нужны: tkinter исключен
+a.datas = [x for x in a.datas if not x[0].startswith(('tcl', 'tk'))]
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries
\ No newline at end of file
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    [],
+    name='activity_agent',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=True,
+    upx=True,
+    upx_exclude=['libpython*.so*'],
+    runtime_tmpdir=None,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)